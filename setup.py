@@ -12,8 +12,15 @@ setup(
     description='Python wrapper for the Tavily API',
     long_description=long_description,
     long_description_content_type='text/x-rst',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'tests.*']),
     install_requires=['requests', 'tiktoken>=0.5.1', 'httpx'],
+    extras_require={
+        'fast': [
+            'orjson',
+            # The zstd extra was added in httpx 0.27.1; older releases would silently skip it.
+            'httpx[http2,brotli,zstd]>=0.27.1',
+        ],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
@@ -1,2 +1,12 @@
-from .async_tavily import AsyncTavilyClient
 from .tavily import Client, TavilyClient
+
+__all__ = ["AsyncTavilyClient", "Client", "TavilyClient"]
+
+
+def __getattr__(name):
+    # The async client pulls in httpx, so it is only imported the first time it is used.
+    if name == "AsyncTavilyClient":
+        from .async_tavily import AsyncTavilyClient
+        globals()[name] = AsyncTavilyClient
+        return AsyncTavilyClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
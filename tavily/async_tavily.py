@@ -1,25 +1,137 @@
 import asyncio
-import json
-from typing import Literal, Sequence
+import copy
+import gzip
+import importlib.util
+import itertools
+import random
+import time
+from heapq import nlargest
+from operator import itemgetter
+from typing import Literal, Optional, Sequence
 
 import httpx
 
-from tavily.utils import get_max_items_from_list
+from tavily.utils import get_max_items_from_list, json_dumps, json_loads, ResponseCache
+
+# HTTP/2 lets concurrent requests share one connection, but httpx needs the optional h2 package for it.
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_get_url_and_content = itemgetter("url", "content")
+_get_score = itemgetter("score")
+
+# Request bodies smaller than this aren't worth compressing.
+_COMPRESS_MIN_BYTES = 2048
+
+# Transient failures worth retrying, the same statuses TavilyClient retries on.
+_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Failures where the request never reached the server. Anything later (e.g. a read timeout) may already have been
+# processed and billed, so it isn't retried.
+_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class _TokenBucket:
+    """
+    Spreads requests out so they stay under a rate limit instead of bouncing off 429 responses.
+    """
+
+    def __init__(self, requests_per_minute: float):
+        self._rate = requests_per_minute / 60
+        self._burst = max(1.0, self._rate)
+        self._tokens = self._burst
+        self._updated_at = time.monotonic()
+
+    async def acquire(self):
+        """
+        Wait until a request may be sent. Each caller reserves its token before sleeping, so waiters are served in
+        order.
+        """
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self._rate)
 
 
 class AsyncTavilyClient:
-    def __init__(self, api_key: str, company_info_tags: Sequence[str] = ("news", "general", "finance")):
-        self._base_data = {
-            "api_key": api_key,
-        }
-        self._client_creator = lambda: httpx.AsyncClient(
-            headers={
+    def __init__(
+        self,
+        api_key: str,
+        company_info_tags: Sequence[str] = ("news", "general", "finance"),
+        requests_per_minute: Optional[float] = None,
+        cache_size: int = 0,
+        cache_ttl: float = 300,
+        compress_requests: bool = False,
+        max_retries: int = 3,
+        retry_backoff: float = 0.3,
+        retry_backoff_max: float = 10,
+        max_concurrency: Optional[int] = None,
+    ):
+        self._api_key = api_key
+        # Built once so (re)creating the HTTP client doesn't rebuild the headers and limits each time.
+        self._client_kwargs = {
+            "headers": {
                 "Content-Type": "application/json",
             },
-            base_url="https://api.tavily.com",
-            timeout=180,
-        )
-        self._company_info_tags = company_info_tags
+            "base_url": "https://api.tavily.com",
+            "timeout": 180,
+            "limits": httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+            "http2": _HTTP2_AVAILABLE,
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._company_info_tags = tuple(company_info_tags)
+        self._rate_limiter = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        # Optional local cache of search responses. Disabled unless cache_size is set.
+        self._cache = ResponseCache(cache_size, cache_ttl) if cache_size else None
+        self._inflight: dict[bytes, list] = {}
+        # Gzip large request bodies (e.g. long include_domains lists). Off by default as it needs server support.
+        self._compress_requests = compress_requests
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._retry_backoff_max = retry_backoff_max
+        # Optional cap on requests in flight at once across all callers. The semaphore is created on first use so
+        # it belongs to the running event loop.
+        self._max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Get the shared HTTP client, creating it on first use so connections are reused across requests.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pooled connections and the concurrency semaphore belong to the event loop that created them, so start
+            # afresh when the client is used from another loop (e.g. a second asyncio.run()).
+            self._loop = loop
+            self._client = None
+            self._semaphore = None
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(**self._client_kwargs)
+        return self._client
+
+    async def aclose(self):
+        """
+        Close the shared HTTP client and release its pooled connections.
+        """
+        if self._client is not None:
+            # Connections opened on another event loop can't be closed from this one; that client is just dropped.
+            if self._loop is asyncio.get_running_loop():
+                await self._client.aclose()
+            self._client = None
+
+    async def warmup(self):
+        """
+        Open a connection to the API ahead of time so the first search doesn't pay for DNS lookup and the TCP/TLS
+        handshakes. Useful to call once when a service starts. The response to the request is ignored.
+        """
+        await self._get_client().get("/")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
 
     async def _search(
         self,
@@ -34,29 +146,139 @@ class AsyncTavilyClient:
         include_raw_content: bool = False,
         include_images: bool = False,
         use_cache: bool = True,
+        local_cache: bool = True,
     ) -> dict:
         """
         Internal search method to send the request to the API.
+
+        local_cache: Whether this search may be served from and stored in the client's local cache (see cache_size)
+        and share a request with identical searches already in flight. Independent of use_cache, which is passed to
+        the API. Defaults to True.
         """
-        data = {
-            **self._base_data,
-            "query": query,
-            "search_depth": search_depth,
-            "topic": topic,
-            "days": days,
-            "include_answer": include_answer,
-            "include_raw_content": include_raw_content,
-            "max_results": max_results,
-            "include_domains": include_domains or None,
-            "exclude_domains": exclude_domains or None,
-            "include_images": include_images,
-            "use_cache": use_cache,
-        }
-        async with self._client_creator() as client:
-            response = await client.post("/search", data=json.dumps(data))
+        # Leave out unset fields instead of sending nulls. Adding the set ones directly is cheaper than building
+        # the full dict and filtering it.
+        data = {"api_key": self._api_key, "query": query, "search_depth": search_depth}
+        if topic is not None:
+            data["topic"] = topic
+        if days is not None:
+            data["days"] = days
+        if include_answer is not None:
+            data["include_answer"] = include_answer
+        if include_raw_content is not None:
+            data["include_raw_content"] = include_raw_content
+        if max_results is not None:
+            data["max_results"] = max_results
+        if include_domains:
+            data["include_domains"] = include_domains
+        if exclude_domains:
+            data["exclude_domains"] = exclude_domains
+        if include_images is not None:
+            data["include_images"] = include_images
+        if use_cache is not None:
+            data["use_cache"] = use_cache
+        if not local_cache:
+            return await self._post("/search", data)
+
+        cache_key = ResponseCache.make_key(data)
+        if self._cache is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # Identical searches that are already in flight share one request instead of each hitting the API.
+        # The request is shielded so one caller being cancelled doesn't cancel it for the others; it is only
+        # cancelled once no caller is waiting for it.
+        inflight = self._inflight.get(cache_key)
+        if inflight is None:
+            task = asyncio.ensure_future(self._fetch_search(cache_key, data))
+            task.add_done_callback(lambda done: self._forget_inflight(cache_key, done))
+            inflight = self._inflight[cache_key] = [task, 0]  # [request, number of waiting callers]
+        task = inflight[0]
+        inflight[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            inflight[1] -= 1
+            if not inflight[1]:
+                # Forget the request before cancelling it so an identical search starting now sends a new one
+                # instead of joining a request that is about to be cancelled.
+                if self._inflight.get(cache_key) is inflight:
+                    del self._inflight[cache_key]
+                task.cancel()
+        # Every caller, the first included, gets its own copy so changes one makes don't leak into the others.
+        return copy.deepcopy(result)
 
+    async def _fetch_search(self, cache_key: bytes, data: dict) -> dict:
+        """
+        Send a coalesced search. The returned response is shared by every waiting caller and is never handed out
+        itself, only copies of it.
+        """
+        result = await self._post("/search", data)
+        if self._cache is not None:
+            self._cache.set(cache_key, result)
+        return result
+
+    def _forget_inflight(self, cache_key: bytes, task: asyncio.Task):
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None and inflight[0] is task:
+            del self._inflight[cache_key]
+        if not task.cancelled():
+            task.exception()  # Mark the error as retrieved in case every waiter was cancelled.
+
+    async def _post(self, path: str, data: dict) -> dict:
+        """
+        Send a JSON payload to an API endpoint over the shared client and return the parsed response.
+        Rate limited (429), server error (5xx) and failed connection attempts are retried up to max_retries times.
+        """
+        body = json_dumps(data)
+        headers = None
+        if self._compress_requests and len(body) > _COMPRESS_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=1)
+            headers = {"Content-Encoding": "gzip"}
+        for attempt in itertools.count():
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire()
+            try:
+                response = await self._send(path, body, headers)
+            except _RETRY_ERRORS:
+                if attempt >= self._max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code not in _RETRY_STATUSES or attempt >= self._max_retries:
+                return self._handle_response(response)
+            await asyncio.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+
+    async def _send(self, path: str, body: bytes, headers: Optional[dict]) -> httpx.Response:
+        client = self._get_client()
+        if self._max_concurrency is None:
+            return await client.post(path, content=body, headers=headers)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        async with self._semaphore:
+            return await client.post(path, content=body, headers=headers)
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        How long to wait before the next attempt. A Retry-After header given in seconds is honoured, capped at
+        retry_backoff_max; otherwise the delay is drawn uniformly up to an exponentially growing cap ("full jitter")
+        so that clients throttled at the same moment don't all retry together.
+        """
+        if retry_after is not None:
+            try:
+                return min(self._retry_backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass  # An HTTP date rather than a number of seconds
+        return random.uniform(0, min(self._retry_backoff_max, self._retry_backoff * 2 ** attempt))
+
+    @staticmethod
+    def _handle_response(response: httpx.Response) -> dict:
+        """
+        Parse the body of a successful response. The body is only parsed on success; failures go straight to
+        raise_for_status().
+        """
         if response.status_code == 200:
-            return response.json()
+            return json_loads(response.content)
         else:
             response.raise_for_status()  # Raises a HTTPError if the HTTP request returned an unsuccessful status code
 
@@ -66,6 +288,28 @@ class AsyncTavilyClient:
         """
         return await self._search(query, search_depth=search_depth, **kwargs)
 
+    async def batch_search(
+        self, queries: Sequence[str], concurrency: int = 10, return_exceptions: bool = True, **kwargs
+    ) -> list:
+        """
+        Run several searches concurrently over the shared HTTP client.
+
+        concurrency: The maximum number of requests in flight at once. Defaults to 10.
+        return_exceptions: If True, a failed search puts its exception in the results instead of failing the whole
+        batch. Defaults to True.
+
+        Returns the search results in the same order as the queries.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _perform_search(query: str):
+            async with semaphore:
+                return await self.search(query, **kwargs)
+
+        return await asyncio.gather(
+            *[_perform_search(query) for query in queries], return_exceptions=return_exceptions
+        )
+
     async def get_search_context(
         self, query: str, search_depth: Literal["basic", "advanced"] = "basic", max_tokens=4000, **kwargs
     ):
@@ -79,8 +323,8 @@ class AsyncTavilyClient:
         """
         search_result = await self._search(query, search_depth, **kwargs)
         sources = search_result.get("results", [])
-        context = [{"url": obj["url"], "content": obj["content"]} for obj in sources]
-        return json.dumps(get_max_items_from_list(context, max_tokens))
+        context = ({"url": url, "content": content} for url, content in map(_get_url_and_content, sources))
+        return json_dumps(get_max_items_from_list(context, max_tokens)).decode()
 
     async def qna_search(self, query: str, search_depth: Literal["basic", "advanced"] = "advanced", **kwargs) -> str:
         """
@@ -90,21 +334,57 @@ class AsyncTavilyClient:
         return search_result.get("answer", "")
 
     async def get_company_info(
-        self, query: str, search_depth: Literal["basic", "advanced"] = "basic", max_results=5, **kwargs
+        self,
+        query: str,
+        search_depth: Literal["basic", "advanced"] = "basic",
+        max_results=5,
+        early_stop_score: Optional[float] = None,
+        **kwargs,
     ) -> list[dict]:
-        """Q&A search method. Search depth is advanced by default to get the best answer."""
+        """
+        Q&A search method. Search depth is advanced by default to get the best answer.
+
+        early_stop_score: If set, stop waiting for the remaining topics once 'max_results' results scoring at least
+        this much have arrived, and cancel their searches. Trades completeness for latency. Defaults to None.
+
+        Topics whose search fails are skipped; the first error is only raised if every topic fails.
+        """
 
         async def _perform_search(topic: str):
             return await self._search(
                 query, search_depth=search_depth, topic=topic, max_results=max_results, include_answer=False, **kwargs
             )
 
-        all_results = []
-        for data in await asyncio.gather(*[_perform_search(topic) for topic in self._company_info_tags]):
-            if "results" in data:
-                all_results.extend(data["results"])
+        # Merge each topic's results as soon as it arrives. A page returned by more than one topic keeps its
+        # highest-scoring copy, whichever topic answered first; results without a url are always kept.
+        best_results = {}
+        errors = []
+        tasks = [asyncio.ensure_future(_perform_search(topic)) for topic in self._company_info_tags]
+        try:
+            for next_data in asyncio.as_completed(tasks):
+                try:
+                    data = await next_data
+                except Exception as error:
+                    # A single failing topic (e.g. a 429) shouldn't throw away the results of the others
+                    errors.append(error)
+                    continue
+                for result in data.get("results") or ():
+                    url = result.get("url")
+                    key = url if url is not None else object()
+                    kept = best_results.get(key)
+                    if kept is None or result["score"] > kept["score"]:
+                        best_results[key] = result
+                if early_stop_score is not None and len(best_results) >= max_results:
+                    top_results = nlargest(max_results, best_results.values(), key=_get_score)
+                    if top_results and top_results[-1]["score"] >= early_stop_score:
+                        break
+        finally:
+            # Cancel searches still running after an early stop or a failure (a no-op for finished ones)
+            for task in tasks:
+                task.cancel()
 
-        # Sort all the results by score in descending order and take the top 'max_results' items
-        sorted_results = sorted(all_results, key=lambda x: x["score"], reverse=True)[:max_results]
+        if errors and len(errors) == len(tasks):
+            raise errors[0]
 
-        return sorted_results
+        # Take the top 'max_results' items by score in descending order, without sorting the whole list
+        return nlargest(max_results, best_results.values(), key=_get_score)
@@ -1,42 +1,91 @@
 import requests
-import json
 import warnings
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from .utils import get_max_items_from_list
+from heapq import nlargest
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .utils import get_max_items_from_list, json_dumps, json_loads, ResponseCache
+
+_get_url_and_content = itemgetter("url", "content")
+_get_score = itemgetter("score")
 
 
 class TavilyClient:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_size=0, cache_ttl=300):
         self.base_url = "https://api.tavily.com/search"
         self.api_key = api_key
         self.headers = {
             "Content-Type": "application/json",
         }
+        # A shared session keeps connections to the API alive between calls, so only the first
+        # request pays for the TCP and TLS handshakes.
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        # Read errors aren't retried: the API may already have processed (and billed) the search. Retry-After is
+        # ignored in favour of the short backoff, as urllib3 would otherwise sleep for up to six hours.
+        retries = Retry(total=3, read=False, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=["POST"], respect_retry_after_header=False, raise_on_status=False)
+        self._session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+        # Optional local cache of search responses. Disabled unless cache_size is set.
+        self._cache = ResponseCache(cache_size, cache_ttl) if cache_size else None
+
+    def close(self):
+        """
+        Close the underlying HTTP session and release pooled connections.
+        """
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def _search(self, query, search_depth="basic", topic="general", max_results=5,
                 include_domains=None, exclude_domains=None,
                 include_answer=False, include_raw_content=False, include_images=False,
-                use_cache=True):
+                use_cache=True, local_cache=True):
         """
         Internal search method to send the request to the API.
+
+        local_cache: Whether this search may be served from and stored in the client's local cache (see cache_size).
+        Independent of use_cache, which is passed to the API. Defaults to True.
         """
-        data = {
-            "query": query,
-            "search_depth": search_depth,
-            "topic": topic,
-            "include_answer": include_answer,
-            "include_raw_content": include_raw_content,
-            "max_results": max_results,
-            "include_domains": include_domains or None,
-            "exclude_domains": exclude_domains or None,
-            "include_images": include_images,
-            "api_key": self.api_key,
-            "use_cache": use_cache,
-        }
-        response = requests.post(self.base_url, data=json.dumps(data), headers=self.headers, timeout=100)
+        # Leave out unset fields instead of sending nulls. Adding the set ones directly is cheaper than building
+        # the full dict and filtering it.
+        data = {"query": query, "search_depth": search_depth}
+        if topic is not None:
+            data["topic"] = topic
+        if include_answer is not None:
+            data["include_answer"] = include_answer
+        if include_raw_content is not None:
+            data["include_raw_content"] = include_raw_content
+        if max_results is not None:
+            data["max_results"] = max_results
+        if include_domains:
+            data["include_domains"] = include_domains
+        if exclude_domains:
+            data["exclude_domains"] = exclude_domains
+        if include_images is not None:
+            data["include_images"] = include_images
+        data["api_key"] = self.api_key
+        if use_cache is not None:
+            data["use_cache"] = use_cache
+        cache_key = None
+        if self._cache is not None and local_cache:
+            cache_key = self._cache.make_key(data)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        response = self._session.post(self.base_url, data=json_dumps(data), timeout=100)
 
         if response.status_code == 200:
-            return response.json()
+            result = json_loads(response.content)
+            if cache_key is not None:
+                self._cache.set(cache_key, result)
+            return result
         else:
             response.raise_for_status()  # Raises a HTTPError if the HTTP request returned an unsuccessful status code
 
@@ -57,8 +106,8 @@ class TavilyClient:
         """
         search_result = self._search(query, search_depth, **kwargs)
         sources = search_result.get("results", [])
-        context = [{"url": obj["url"], "content": obj["content"]} for obj in sources]
-        return json.dumps(get_max_items_from_list(context, max_tokens))
+        context = ({"url": url, "content": content} for url, content in map(_get_url_and_content, sources))
+        return json_dumps(get_max_items_from_list(context, max_tokens)).decode()
 
     def qna_search(self, query, search_depth="advanced", **kwargs):
         """
@@ -79,16 +128,30 @@ class TavilyClient:
             future_to_topic = {executor.submit(_perform_search, topic): topic for topic in
                                ["news", "general", "finance"]}
 
-            all_results = []
+            best_results = {}
+            errors = []
 
-            # Process the results as they become available
+            # Process the results as they become available. A page returned by more than one topic keeps its
+            # highest-scoring copy, whichever topic answered first; results without a url are always kept.
             for future in as_completed(future_to_topic):
-                data = future.result()
-                if 'results' in data:
-                    all_results.extend(data['results'])
-
-        # Sort all the results by score in descending order and take the top 'max_results' items
-        sorted_results = sorted(all_results, key=lambda x: x['score'], reverse=True)[:max_results]
+                try:
+                    data = future.result()
+                except Exception as error:
+                    # A single failing topic (e.g. a 429) shouldn't throw away the results of the others
+                    errors.append(error)
+                    continue
+                for result in data.get('results') or ():
+                    url = result.get('url')
+                    key = url if url is not None else object()
+                    kept = best_results.get(key)
+                    if kept is None or result['score'] > kept['score']:
+                        best_results[key] = result
+
+        if errors and len(errors) == len(future_to_topic):
+            raise errors[0]
+
+        # Take the top 'max_results' items by score in descending order, without sorting the whole list
+        sorted_results = nlargest(max_results, best_results.values(), key=_get_score)
 
         return sorted_results
 
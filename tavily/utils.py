@@ -1,13 +1,42 @@
-import tiktoken
+import copy
+import functools
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
 from .config import DEFAULT_MODEL_ENCODING, DEFAULT_MAX_TOKENS
 
+# orjson (installed with the "fast" extra) is several times faster than the json module. It reads response bodies
+# straight from bytes and serializes request bodies straight to bytes.
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+
+@functools.lru_cache(maxsize=8)
+def _get_encoding(encoding_name: str):
+    """
+        Get the tiktoken encoding for a model, looked up once per model name.
+        tiktoken is imported here rather than at module level since it is slow to load and most calls never count
+        tokens.
+    """
+    import tiktoken
+    return tiktoken.encoding_for_model(encoding_name)
+
+
+@functools.lru_cache(maxsize=1024)
 def get_total_tokens_from_string(string: str, encoding_name: str = DEFAULT_MODEL_ENCODING) -> int:
     """
-        Get total amount of tokens from string using the specified encoding (based on openai compute)
+        Get total amount of tokens from string using the specified encoding (based on openai compute).
+        Counts are memoized, so sources that come back again across searches are not re-tokenized.
     """
-    encoding = tiktoken.encoding_for_model(encoding_name)
+    encoding = _get_encoding(encoding_name)
     tokens = encoding.encode(string)
     return len(tokens)
 
@@ -16,15 +45,18 @@ def get_max_tokens_from_string(string: str, max_tokens: int, encoding_name: str
     """
         Extract max tokens from string using the specified encoding (based on openai compute)
     """
-    encoding = tiktoken.encoding_for_model(encoding_name)
+    encoding = _get_encoding(encoding_name)
     tokens = encoding.encode(string)
-    token_bytes = [encoding.decode_single_token_bytes(token) for token in tokens[:max_tokens]]
-    return b"".join(token_bytes).decode()
+    if len(tokens) <= max_tokens:
+        return string
+    # Decode the kept tokens in one call; a multi-byte character cut at the boundary is dropped.
+    return encoding.decode_bytes(tokens[:max_tokens]).decode(errors="ignore")
 
 
-def get_max_items_from_list(data: [], max_tokens: int = DEFAULT_MAX_TOKENS):
+def get_max_items_from_list(data: Iterable, max_tokens: int = DEFAULT_MAX_TOKENS):
     """
-        Get max items from list of items based on defined max tokens (based on openai compute)
+        Get max items from list of items based on defined max tokens (based on openai compute).
+        Accepts any iterable, so items past the token limit are never built when a generator is passed.
     """
     result = []
     current_tokens = 0
@@ -37,3 +69,42 @@ def get_max_items_from_list(data: [], max_tokens: int = DEFAULT_MAX_TOKENS):
             result.append(item_str)
             current_tokens = new_total_tokens
     return json.dumps(result)
+
+
+class ResponseCache:
+    """
+        In-process LRU cache of parsed API responses, keyed by the request payload (without the api key).
+        Entries older than ttl seconds are treated as missing.
+    """
+
+    def __init__(self, max_size: int, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(data: dict) -> bytes:
+        payload = json.dumps({k: v for k, v in data.items() if k != "api_key"}, sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+
+    def get(self, key: bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Hand out copies so callers can't mutate the cached response.
+        return copy.deepcopy(value)
+
+    def set(self, key: bytes, value: dict):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from tavily import AsyncTavilyClient
+
+
+def _make_client(handler, **kwargs) -> AsyncTavilyClient:
+    client = AsyncTavilyClient("tvly-test", **kwargs)
+    client._client_kwargs["transport"] = httpx.MockTransport(handler)
+    return client
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b'{"results": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EventLoopTest(unittest.TestCase):
+    def test_client_can_be_used_from_several_event_loops(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = AsyncTavilyClient("tvly-test", max_concurrency=2)
+        client._client_kwargs["base_url"] = "http://127.0.0.1:%d" % server.server_address[1]
+        client._client_kwargs["http2"] = False
+        for _ in range(2):
+            self.assertEqual(asyncio.run(client.search("q", local_cache=False)), {"results": []})
+        asyncio.run(client.aclose())
+
+
+class CoalescedSearchTest(unittest.TestCase):
+    def test_callers_do_not_share_the_response(self):
+        requests = []
+
+        async def handler(request):
+            requests.append(request)
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"results": [{"url": "https://example.com", "score": 0.9}]})
+
+        async def first_caller(client):
+            result = await client.search("q")
+            result["results"].clear()
+            return result
+
+        async def run():
+            async with _make_client(handler) as client:
+                return await asyncio.gather(first_caller(client), client.search("q"))
+
+        first, second = asyncio.run(run())
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(first, {"results": []})
+        self.assertEqual(second, {"results": [{"url": "https://example.com", "score": 0.9}]})
+
+    def test_request_survives_until_the_last_waiter_is_cancelled(self):
+        cancelled = []
+
+        async def handler(request):
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled.append(request)
+                raise
+            return httpx.Response(200, json={"results": []})
+
+        async def run():
+            async with _make_client(handler) as client:
+                first = asyncio.ensure_future(client.search("q"))
+                second = asyncio.ensure_future(client.search("q"))
+                await asyncio.sleep(0.01)
+                first.cancel()
+                self.assertEqual(await second, {"results": []})
+                self.assertTrue(first.cancelled())
+                self.assertEqual(cancelled, [])
+
+                third = asyncio.ensure_future(client.search("q"))
+                await asyncio.sleep(0.01)
+                third.cancel()
+                await asyncio.sleep(0.01)
+                self.assertEqual(len(cancelled), 1)
+                self.assertEqual(client._inflight, {})
+
+        asyncio.run(run())
+
+
+class EarlyStopTest(unittest.TestCase):
+    @staticmethod
+    async def _handler(request):
+        topic = json.loads(request.content)["topic"]
+        if topic == "news":
+            return httpx.Response(200, json={"results": [{"url": "https://example.com/news", "score": 0.95}]})
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"results": [{"url": "https://example.com/" + topic, "score": 0.5}]})
+
+    def test_early_stop_cancels_the_remaining_topics(self):
+        async def run():
+            async with _make_client(self._handler) as client:
+                results = await client.get_company_info("nvidia", max_results=1, early_stop_score=0.9)
+                await asyncio.sleep(0)
+                self.assertEqual(client._inflight, {})
+                return results
+
+        self.assertEqual(asyncio.run(run()), [{"url": "https://example.com/news", "score": 0.95}])
+
+    def test_repeated_call_after_early_stop(self):
+        async def run():
+            async with _make_client(self._handler) as client:
+                first = await client.get_company_info("nvidia", max_results=1, early_stop_score=0.9)
+                second = await client.get_company_info("nvidia", max_results=1, early_stop_score=0.9)
+                return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(second, [{"url": "https://example.com/news", "score": 0.95}])
+
+
+class CompanyInfoTest(unittest.TestCase):
+    def test_overlapping_url_keeps_its_best_score(self):
+        async def handler(request):
+            topic = json.loads(request.content)["topic"]
+            if topic == "news":
+                return httpx.Response(200, json={"results": [{"url": "https://example.com/a", "score": 0.3}]})
+            await asyncio.sleep(0.01)
+            if topic == "general":
+                return httpx.Response(200, json={"results": [{"url": "https://example.com/a", "score": 0.9}]})
+            return httpx.Response(200, json={"results": [{"url": "https://example.com/b", "score": 0.5}]})
+
+        async def run():
+            async with _make_client(handler) as client:
+                return await client.get_company_info("nvidia", max_results=2)
+
+        self.assertEqual(asyncio.run(run()), [
+            {"url": "https://example.com/a", "score": 0.9},
+            {"url": "https://example.com/b", "score": 0.5},
+        ])
+
+
+class LocalCacheTest(unittest.TestCase):
+    def _run(self, *searches):
+        bodies = []
+
+        def handler(request):
+            bodies.append(json.loads(request.content))
+            return httpx.Response(200, json={"results": []})
+
+        async def run():
+            async with _make_client(handler, cache_size=8) as client:
+                for kwargs in searches:
+                    await client.search("q", **kwargs)
+
+        asyncio.run(run())
+        return bodies
+
+    def test_api_use_cache_does_not_bypass_local_cache(self):
+        bodies = self._run({"use_cache": False}, {"use_cache": False})
+        self.assertEqual(len(bodies), 1)
+        self.assertIs(bodies[0]["use_cache"], False)
+
+    def test_local_cache_false_bypasses_local_cache(self):
+        bodies = self._run({}, {"local_cache": False})
+        self.assertEqual(len(bodies), 2)
+        self.assertIs(bodies[1]["use_cache"], True)
+        self.assertNotIn("local_cache", bodies[1])
+
+
+class RetryTest(unittest.TestCase):
+    def _search(self, handler, **kwargs):
+        async def run():
+            async with _make_client(handler, retry_backoff=0.001, **kwargs) as client:
+                return await client.search("q", local_cache=False)
+
+        return asyncio.run(run())
+
+    def test_connect_error_is_retried(self):
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            if len(attempts) == 1:
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(200, json={"results": []})
+
+        self.assertEqual(self._search(handler), {"results": []})
+        self.assertEqual(len(attempts), 2)
+
+    def test_read_timeout_is_not_retried(self):
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        with self.assertRaises(httpx.ReadTimeout):
+            self._search(handler)
+        self.assertEqual(len(attempts), 1)
+
+    def test_client_errors_are_not_retried(self):
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            return httpx.Response(401, json={"detail": {"error": "Unauthorized"}})
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            self._search(handler)
+        self.assertEqual(len(attempts), 1)
+
+    def test_retry_after_is_capped(self):
+        client = AsyncTavilyClient("tvly-test", retry_backoff_max=10)
+        self.assertEqual(client._retry_delay(0, "2"), 2)
+        self.assertEqual(client._retry_delay(0, "3600"), 10)
+        self.assertEqual(client._retry_delay(0, "inf"), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import time
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.exceptions import NewConnectionError, ReadTimeoutError
+
+from tavily import TavilyClient
+
+
+class _FakeAdapter(BaseAdapter):
+    def __init__(self):
+        super().__init__()
+        self.bodies = []
+
+    def send(self, request, **kwargs):
+        self.bodies.append(json.loads(request.body))
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        response._content = b'{"results": []}'
+        return response
+
+    def close(self):
+        pass
+
+
+class LocalCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TavilyClient("tvly-test", cache_size=8)
+        self.adapter = _FakeAdapter()
+        self.client._session.mount("https://", self.adapter)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_api_use_cache_does_not_bypass_local_cache(self):
+        self.client.search("q", use_cache=False)
+        self.client.search("q", use_cache=False)
+        self.assertEqual(len(self.adapter.bodies), 1)
+        self.assertIs(self.adapter.bodies[0]["use_cache"], False)
+
+    def test_local_cache_false_bypasses_local_cache(self):
+        self.client.search("q")
+        self.client.search("q", local_cache=False)
+        self.assertEqual(len(self.adapter.bodies), 2)
+        self.assertIs(self.adapter.bodies[1]["use_cache"], True)
+        self.assertNotIn("local_cache", self.adapter.bodies[1])
+
+
+class _TopicAdapter(BaseAdapter):
+    # news answers first with the lowest score for the page that general also returns
+    RESULTS = {
+        "news": [{"url": "https://example.com/a", "score": 0.3}],
+        "general": [{"url": "https://example.com/a", "score": 0.9}],
+        "finance": [{"url": "https://example.com/b", "score": 0.5}],
+    }
+
+    def send(self, request, **kwargs):
+        topic = json.loads(request.body)["topic"]
+        if topic != "news":
+            time.sleep(0.05)
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        response._content = json.dumps({"results": self.RESULTS[topic]}).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+class CompanyInfoTest(unittest.TestCase):
+    def test_overlapping_url_keeps_its_best_score(self):
+        with TavilyClient("tvly-test") as client:
+            client._session.mount("https://", _TopicAdapter())
+            results = client.get_company_info("nvidia", max_results=2)
+        self.assertEqual(results, [
+            {"url": "https://example.com/a", "score": 0.9},
+            {"url": "https://example.com/b", "score": 0.5},
+        ])
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        client = TavilyClient("tvly-test")
+        self.addCleanup(client.close)
+        self.retries = client._session.get_adapter(client.base_url).max_retries
+
+    def test_connection_errors_are_retried(self):
+        retries = self.retries.increment(method="POST", url="/search", error=NewConnectionError(None, "refused"))
+        self.assertEqual(retries.total, self.retries.total - 1)
+
+    def test_read_errors_are_not_retried(self):
+        with self.assertRaises(ReadTimeoutError):
+            self.retries.increment(method="POST", url="/search", error=ReadTimeoutError(None, "/search", "timed out"))
+
+    def test_retry_after_is_not_honoured(self):
+        self.assertFalse(self.retries.respect_retry_after_header)
+
+
+if __name__ == "__main__":
+    unittest.main()